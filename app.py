@@ -3,21 +3,33 @@ from werkzeug.utils import secure_filename
 from database import Database
 from dotenv import load_dotenv
 import os
-import anthropic
+import threading
 from datetime import datetime
 
-# Load environment variables
+# Load environment variables (cheap; the Anthropic import is what stays lazy)
 load_dotenv()
 
 app = Flask(__name__, static_folder='static')
-db = Database()
-client = anthropic.Client(api_key=os.getenv('ANTHROPIC_API_KEY'))
+# Set JOURNAL_COMPRESS_CONTENT=1 to store large entry bodies compressed
+db = Database(compress_content=os.getenv('JOURNAL_COMPRESS_CONTENT') == '1')
 
 # For demo purposes, using a static user_id
 DEMO_USER_ID = "demo_user"
 
-# Ensure the media directory exists
-os.makedirs('media', exist_ok=True)
+# The Anthropic client (and its heavy imports) is built on first use
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Return the shared Anthropic client, creating it on first call"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import anthropic
+
+                _client = anthropic.Client(api_key=os.getenv('ANTHROPIC_API_KEY'))
+    return _client
 
 @app.route('/')
 def index():
@@ -28,9 +40,11 @@ def get_entries():
     tag = request.args.get('tag')
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
+    # ?summary=1 skips entry bodies for lightweight listings
+    include_content = request.args.get('summary') != '1'
     
     try:
-        entries = db.get_entries(DEMO_USER_ID, tag, start_date, end_date)
+        entries = db.get_entries(DEMO_USER_ID, tag, start_date, end_date, include_content)
         
         # Convert local file paths to URLs
         for entry in entries:
@@ -185,10 +199,9 @@ def upload_image():
             return jsonify({'error': 'No selected file'}), 400
         
         filename = secure_filename(file.filename)
-        file_path = os.path.join('media', filename)
-        file.save(file_path)
+        stored_name = db.save_upload(file, filename)
         
-        file_url = url_for('serve_media', filename=filename, _external=True)
+        file_url = url_for('serve_media', filename=stored_name, _external=True)
         return jsonify({'uploaded': True, 'url': file_url})
     except Exception as e:
         print(f"Error uploading image: {str(e)}")
@@ -205,7 +218,7 @@ def generate_question():
         if suggestion:
             prompt_content += f" Consider the following suggestion: {suggestion}."
 
-        message = client.messages.create(
+        message = get_client().messages.create(
             model="claude-3-5-sonnet-20241022",
             max_tokens=1000,
             temperature=0,
@@ -231,6 +244,23 @@ def generate_question():
         default_question = "What is a meaningful memory from your past that has shaped who you are today?"
         return jsonify({'question': default_question})
 
+@app.cli.command('maintenance')
+def run_maintenance():
+    """Run database maintenance once and print what was reclaimed"""
+    report = db.run_maintenance()
+    print("=== Maintenance Report ===")
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+@app.cli.command('backfill-content')
+def backfill_content():
+    """Move inline base64 images into the media store and compress large bodies if enabled"""
+    updated = db.backfill_content()
+    print(f"Rewrote content of {updated} entries")
+
 if __name__ == '__main__':
+    # Only start the scheduler in the reloader's child process, not the watcher
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        db.start_maintenance_scheduler()
     # Use port 5001 to avoid conflicts with AirPlay
     app.run(debug=True, port=5001)
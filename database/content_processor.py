@@ -0,0 +1,98 @@
+import base64
+import binascii
+import re
+import zlib
+
+# <img ... src="data:image/png;base64,...">, capturing everything needed to rewrite src in place
+INLINE_IMAGE_PATTERN = re.compile(
+    r'''(<img\b[^>]*?\bsrc\s*=\s*)(["'])data:(image/[\w.+-]+);base64,([^"']*)\2''',
+    re.IGNORECASE
+)
+
+# Stands in for an extracted image's URL until the entry id is known
+INLINE_PLACEHOLDER = 'inline-media:{}'
+
+# First byte of a compressed body; bump for a new codec and keep decoding the old ones
+ZLIB_FORMAT = b'\x01'
+
+class ContentProcessor:
+    def __init__(self, media_handler, compress=False, compress_threshold=4096):
+        self.media_handler = media_handler
+        self.compress = compress
+        self.COMPRESS_THRESHOLD = compress_threshold  # Bytes of HTML before a body is worth compressing
+        self.MIME_EXTENSIONS = {
+            'image/jpeg': 'jpg',
+            'image/jpg': 'jpg',
+            'image/png': 'png',
+            'image/gif': 'gif'
+        }
+
+    def encode(self, content):
+        """Convert content to its stored form, compressing large bodies when enabled"""
+        if not self.compress or content is None:
+            return content
+
+        raw = content.encode('utf-8')
+        if len(raw) < self.COMPRESS_THRESHOLD:
+            return content
+
+        compressed = ZLIB_FORMAT + zlib.compress(raw, 6)
+        # Stored as a BLOB; plain TEXT rows are never mistaken for compressed ones
+        return compressed if len(compressed) < len(raw) else content
+
+    def decode(self, stored):
+        """Convert stored content back to HTML, whatever mode it was written in"""
+        if not isinstance(stored, bytes):
+            return stored
+
+        if stored[:1] == ZLIB_FORMAT:
+            return zlib.decompress(stored[1:]).decode('utf-8')
+        raise ValueError(f"Unknown content format: {stored[:1]!r}")
+
+    def has_inline_images(self, content):
+        """Check whether content contains any data URI images"""
+        return bool(content) and INLINE_IMAGE_PATTERN.search(content) is not None
+
+    def stage_inline_images(self, content, media_path):
+        """Decode data URI images and write them to staging, outside any transaction.
+
+        Returns (content, staged_images). Each staged image's src is replaced by
+        a placeholder that attach_inline_images turns into its /media/ URL.
+        """
+        staged_images = []
+        if not self.has_inline_images(content):
+            return content, staged_images
+
+        def replace(match):
+            prefix, quote, mime, payload = match.groups()
+            extension = self.MIME_EXTENSIONS.get(mime.lower())
+            if not extension:
+                # Leave types we don't serve (e.g. svg) inline
+                return match.group(0)
+
+            try:
+                data = base64.b64decode(re.sub(r'\s+', '', payload), validate=True)
+            except (binascii.Error, ValueError):
+                return match.group(0)
+
+            if len(data) > self.media_handler.MAX_FILE_SIZE:
+                # Over the upload limit; keep it inline rather than reject the entry
+                return match.group(0)
+
+            staged = self.media_handler.stage_bytes(data, f"inline.{extension}", 'inline', media_path)
+            staged_images.append(staged)
+            return f"{prefix}{quote}{INLINE_PLACEHOLDER.format(staged['media_id'])}{quote}"
+
+        try:
+            content = INLINE_IMAGE_PATTERN.sub(replace, content)
+        except Exception:
+            self.media_handler.discard_staged(staged_images)
+            raise
+        return content, staged_images
+
+    def attach_inline_images(self, cursor, entry_id, content, staged_images, media_path):
+        """Record staged inline images for an entry and point their placeholders at /media/ URLs"""
+        for staged in staged_images:
+            url = self.media_handler.save_inline_image(cursor, entry_id, staged, media_path)
+            content = content.replace(INLINE_PLACEHOLDER.format(staged['media_id']), url)
+        return content
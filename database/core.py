@@ -1,34 +1,77 @@
 import sqlite3
-import os
+import threading
 from .media_handler import MediaHandler
 from .tag_manager import TagManager
 from .entry_manager import EntryManager
+from .content_processor import ContentProcessor
+from .maintenance import MaintenanceManager, MaintenanceScheduler
+from .write_queue import WriteQueue
+from .media_outbox import MediaOutbox
+
+# Bump whenever _init_db gains new tables or migrations
+SCHEMA_VERSION = 2
 
 class Database:
-    def __init__(self):
+    def __init__(self, compress_content=False):
         # Initialize paths
         self.db_path = 'journal.db'
         self.media_path = 'media'
         
-        # Create media directory if it doesn't exist
-        os.makedirs(self.media_path, exist_ok=True)
-        
         # Initialize managers
         self.media_handler = MediaHandler()
         self.tag_manager = TagManager()
-        self.entry_manager = EntryManager(self.media_handler, self.tag_manager)
+        # Optional storage mode: large entry bodies are zlib-compressed on write
+        self.content_processor = ContentProcessor(self.media_handler, compress=compress_content)
+        self.entry_manager = EntryManager(self.media_handler, self.tag_manager, self.content_processor)
+        self.maintenance = MaintenanceManager(self.media_handler, self.content_processor)
+        self._maintenance_scheduler = None
         
-        # Initialize database with tables
-        self._init_db()
+        # All entry writes go through one writer thread that group-commits them
+        self.write_queue = WriteQueue(self._connect)
+        self.media_outbox = MediaOutbox(self._connect, self.write_queue, self.media_handler)
+        
+        # Schema is checked lazily on the first connection, not at import time
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _connect(self):
+        """Open a connection, making sure the schema is initialized first"""
+        if not self._schema_ready:
+            self._ensure_schema()
+        return sqlite3.connect(self.db_path)
 
-    def _init_db(self):
+    def _ensure_schema(self):
+        """Run the schema setup once per process, and only if the file needs it"""
+        with self._schema_lock:
+            if self._schema_ready:
+                return
+            conn = sqlite3.connect(self.db_path)
+            try:
+                # user_version is stored in the database header, so once any
+                # worker has migrated the file the others skip the DDL entirely
+                version = conn.execute('PRAGMA user_version').fetchone()[0]
+                if version < SCHEMA_VERSION:
+                    self._init_db(conn)
+            finally:
+                conn.close()
+            self._schema_ready = True
+
+    def _init_db(self, conn):
         """Initialize database tables"""
-        conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
 
         try:
-            # Start transaction
-            cursor.execute('BEGIN')
+            # Only takes effect on a new, empty database file
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+            # Take the write lock up front so concurrent workers migrate one at a time
+            cursor.execute('BEGIN IMMEDIATE')
+
+            # Another worker may have finished the migration while we waited
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] >= SCHEMA_VERSION:
+                conn.rollback()
+                return
 
             # Create entries table if not exists
             cursor.execute('''
@@ -61,6 +104,16 @@ class Database:
                 )
             ''')
 
+            # Create media_outbox table (paths waiting for removal) if not exists
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS media_outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0
+                )
+            ''')
+
             # Create entry_tags table if not exists
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS entry_tags (
@@ -114,6 +167,8 @@ class Database:
                 # Drop old table
                 cursor.execute('DROP TABLE media_old')
 
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
             # Commit transaction
             conn.commit()
 
@@ -121,29 +176,32 @@ class Database:
             print(f"Error initializing database: {str(e)}")
             conn.rollback()
             raise e
-        finally:
-            conn.close()
 
-    def create_entry(self, user_id, title, content, tags, entry_date=None, media_files=None):
-        """Create a new journal entry"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
+    def _stage_entry_media(self, content, media_files):
+        """Write new media to staging in the calling thread, before the write is queued"""
+        staged_media = self.media_handler.stage_media_files(media_files, self.media_path)
         try:
-            entry_id = self.entry_manager.create_entry(
-                cursor, user_id, title, content, tags, entry_date, media_files, self.media_path
-            )
-            conn.commit()
-            return entry_id
+            content, inline_images = self.content_processor.stage_inline_images(content, self.media_path)
         except Exception as e:
-            conn.rollback()
+            self.media_handler.discard_staged(staged_media)
             raise e
-        finally:
-            conn.close()
+        return content, staged_media, inline_images
+
+    def create_entry(self, user_id, title, content, tags, entry_date=None, media_files=None):
+        """Create a new journal entry"""
+        content, staged_media, inline_images = self._stage_entry_media(content, media_files)
+        staged_files = staged_media + inline_images
+        return self.write_queue.execute(
+            lambda cursor: self.entry_manager.create_entry(
+                cursor, user_id, title, content, tags, entry_date, staged_media, inline_images, self.media_path
+            ),
+            on_commit=lambda: self.media_handler.finalize_staged(staged_files),
+            on_rollback=lambda: self.media_handler.discard_staged(staged_files)
+        )
 
     def get_entry(self, user_id, entry_id):
         """Get a specific journal entry"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
@@ -151,56 +209,121 @@ class Database:
         finally:
             conn.close()
 
-    def get_entries(self, user_id, tag=None, start_date=None, end_date=None):
+    def get_entries(self, user_id, tag=None, start_date=None, end_date=None, include_content=True):
         """Get journal entries with optional filtering"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
-            return self.entry_manager.get_entries(cursor, user_id, tag, start_date, end_date)
+            return self.entry_manager.get_entries(cursor, user_id, tag, start_date, end_date, include_content)
         finally:
             conn.close()
 
     def update_entry(self, user_id, entry_id, title=None, content=None, entry_date=None, 
                     tags=None, new_media_files=None):
         """Update an existing journal entry"""
-        conn = sqlite3.connect(self.db_path)
+        content, staged_media, inline_images = self._stage_entry_media(content, new_media_files)
+        staged_files = staged_media + inline_images
+        return self.write_queue.execute(
+            lambda cursor: self.entry_manager.update_entry(
+                cursor, user_id, entry_id, title, content, entry_date, 
+                tags, staged_media, inline_images, self.media_path
+            ),
+            on_commit=lambda: self._finalize_update(staged_files),
+            on_rollback=lambda: self.media_handler.discard_staged(staged_files)
+        )
+
+    def _finalize_update(self, staged_files):
+        """Move new files into place and wake the outbox for images the edit removed"""
+        self.media_handler.finalize_staged(staged_files)
+        self.media_outbox.notify()
+
+    def delete_entry(self, user_id, entry_id):
+        """Delete a journal entry"""
+        return self.write_queue.execute(
+            lambda cursor: self.entry_manager.delete_entry(cursor, user_id, entry_id, self.media_path),
+            on_commit=self.media_outbox.notify
+        )
+
+    def get_tags(self, user_id):
+        """Get all tags for a user"""
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
-            success = self.entry_manager.update_entry(
-                cursor, user_id, entry_id, title, content, entry_date, 
-                tags, new_media_files, self.media_path
-            )
-            conn.commit()
-            return success
-        except Exception as e:
-            conn.rollback()
-            return False
+            return self.tag_manager.get_all_tags(cursor, user_id)
         finally:
             conn.close()
 
-    def delete_entry(self, user_id, entry_id):
-        """Delete a journal entry"""
-        conn = sqlite3.connect(self.db_path)
+    def save_upload(self, upload_file, filename):
+        """Save an editor image upload and return its path relative to the media directory"""
+        staged = self.media_handler.stage_upload(upload_file, filename, self.media_path)
+        return self.write_queue.execute(
+            lambda cursor: self.media_handler.save_upload(cursor, staged, self.media_path),
+            on_commit=lambda: self.media_handler.finalize_staged([staged]),
+            on_rollback=lambda: self.media_handler.discard_staged([staged])
+        )
+
+    def backfill_content(self, batch_size=50, vacuum=True):
+        """Extract inline images and apply compression to existing entries, one batch at a time.
+
+        Batches are read and staged on a separate connection, then written through
+        the write queue, which skips rows the server edited in the meantime.
+        """
+        conn = self._connect()
         cursor = conn.cursor()
+        after_id = ''
+        total = 0
         
         try:
-            success = self.entry_manager.delete_entry(cursor, user_id, entry_id, self.media_path)
-            conn.commit()
-            return success
-        except Exception as e:
-            conn.rollback()
-            return False
+            while True:
+                after_id, prepared = self.entry_manager.prepare_backfill(
+                    cursor, self.media_path, after_id, batch_size
+                )
+                if after_id is None:
+                    break
+                staged_files = [staged for _, _, _, inline_images in prepared for staged in inline_images]
+                total += self.write_queue.execute(
+                    lambda cursor, prepared=prepared: self.entry_manager.apply_backfill(
+                        cursor, prepared, self.media_path
+                    ),
+                    on_commit=lambda staged_files=staged_files: self.media_handler.finalize_staged(staged_files),
+                    on_rollback=lambda staged_files=staged_files: self.media_handler.discard_staged(staged_files)
+                )
+            
+            # VACUUM cannot run inside the writer's transactions, so it stays on this connection.
+            # Files created before incremental auto_vacuum need one full VACUUM to switch over
+            convert = conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2
+            if vacuum and (total or convert):
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                # Return the space freed by extracted images and compressed bodies to the filesystem
+                conn.execute('VACUUM')
+            return total
         finally:
             conn.close()
 
-    def get_tags(self, user_id):
-        """Get all tags for a user"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def run_maintenance(self):
+        """Run ANALYZE/optimize, orphan media sweeps, vacuum and checkpointing once"""
+        # Finish deletions left over from a previous process first
+        outbox_removed = self.media_outbox.drain()
+        conn = self._connect()
         
         try:
-            return self.tag_manager.get_all_tags(cursor, user_id)
+            report = self.maintenance.run(conn, self.media_path, self.write_queue)
+            # Remove what the sweep queued now instead of waiting for the worker
+            report['outbox_removed'] = outbox_removed + self.media_outbox.drain()
+            return report
+        except Exception as e:
+            conn.rollback()
+            raise e
         finally:
             conn.close()
+
+    def start_maintenance_scheduler(self, interval_seconds=3600, quiet_hours=(2, 5)):
+        """Run maintenance in the background once per night during quiet hours"""
+        if self._maintenance_scheduler is None:
+            self._maintenance_scheduler = MaintenanceScheduler(
+                self.run_maintenance, interval_seconds, quiet_hours
+            )
+        self._maintenance_scheduler.start()
+        return self._maintenance_scheduler
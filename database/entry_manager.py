@@ -2,21 +2,33 @@ from datetime import datetime
 import uuid
 
 class EntryManager:
-    def __init__(self, media_handler, tag_manager):
+    def __init__(self, media_handler, tag_manager, content_processor):
         self.media_handler = media_handler
         self.tag_manager = tag_manager
+        self.content_processor = content_processor
 
-    def create_entry(self, cursor, user_id, title, content, tags, entry_date=None, media_files=None, media_path=None):
-        """Create a new journal entry with optional media files"""
+    def create_entry(self, cursor, user_id, title, content, tags, entry_date=None, media_files=None,
+                     inline_images=None, media_path=None):
+        """Create a new journal entry with optional media files.
+
+        media_files and inline_images are already staged on disk; this only
+        records their rows, and the caller moves them into place after commit.
+        """
         entry_id = str(uuid.uuid4())
         timestamp = datetime.utcnow().isoformat()
         entry_date = entry_date or timestamp
         
-        # Insert entry
+        # Point pasted images, already moved out of the content, at the media store
+        if inline_images:
+            content = self.content_processor.attach_inline_images(
+                cursor, entry_id, content, inline_images, media_path
+            )
+        
+        # Insert entry (large bodies are compressed when enabled)
         cursor.execute('''
             INSERT INTO entries (id, user_id, title, content, entry_date, created_at, updated_at)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (entry_id, user_id, title, content, entry_date, timestamp, timestamp))
+        ''', (entry_id, user_id, title, self.content_processor.encode(content), entry_date, timestamp, timestamp))
         
         # Handle media files
         if media_files:
@@ -44,11 +56,11 @@ class EntryManager:
         # Get tags
         tags = self.tag_manager.get_entry_tags(cursor, entry_id)
         
-        # Get media files
+        # Get media files (inline images are already shown in the content)
         cursor.execute('''
             SELECT filename, filepath, file_type, file_size
             FROM media
-            WHERE entry_id = ?
+            WHERE entry_id = ? AND file_type IS NOT 'inline'
         ''', (entry_id,))
         
         media = [{
@@ -61,7 +73,7 @@ class EntryManager:
         return {
             'id': entry[0],
             'title': entry[1],
-            'content': entry[2],
+            'content': self.content_processor.decode(entry[2]),
             'entry_date': entry[3],
             'created_at': entry[4],
             'updated_at': entry[5],
@@ -69,10 +81,15 @@ class EntryManager:
             'media': media
         }
 
-    def get_entries(self, cursor, user_id, tag=None, start_date=None, end_date=None):
-        """Get journal entries with optional filtering"""
-        query = '''
-            SELECT DISTINCT e.id, e.title, e.content, e.entry_date, e.created_at, e.updated_at
+    def get_entries(self, cursor, user_id, tag=None, start_date=None, end_date=None, include_content=True):
+        """Get journal entries with optional filtering.
+
+        With include_content=False the body column is never read, which keeps
+        summary listings cheap for long or compressed entries.
+        """
+        content_column = 'e.content' if include_content else 'NULL'
+        query = f'''
+            SELECT DISTINCT e.id, e.title, {content_column}, e.entry_date, e.created_at, e.updated_at
             FROM entries e
         '''
         params = [user_id]
@@ -103,11 +120,11 @@ class EntryManager:
             entry_id = row[0]
             tags = self.tag_manager.get_entry_tags(cursor, entry_id)
             
-            # Get media for entry
+            # Get media for entry (inline images are already shown in the content)
             cursor.execute('''
                 SELECT filename, filepath, file_type, file_size
                 FROM media
-                WHERE entry_id = ?
+                WHERE entry_id = ? AND file_type IS NOT 'inline'
             ''', (entry_id,))
             
             media = [{
@@ -117,22 +134,24 @@ class EntryManager:
                 'size': r[3] or 0  # Default to 0 if NULL
             } for r in cursor.fetchall()]
             
-            entries.append({
+            entry = {
                 'id': entry_id,
                 'title': row[1],
-                'content': row[2],
                 'entry_date': row[3],
                 'created_at': row[4],
                 'updated_at': row[5],
                 'tags': tags,
                 'media': media
-            })
+            }
+            if include_content:
+                entry['content'] = self.content_processor.decode(row[2])
+            entries.append(entry)
         
         return entries
 
     def update_entry(self, cursor, user_id, entry_id, title=None, content=None, entry_date=None, 
-                    tags=None, new_media_files=None, media_path=None):
-        """Update an existing journal entry"""
+                    tags=None, new_media_files=None, inline_images=None, media_path=None):
+        """Update an existing journal entry; new files are staged as for create_entry"""
         # Verify entry exists and belongs to user
         cursor.execute('''
             SELECT 1 FROM entries
@@ -150,8 +169,14 @@ class EntryManager:
             updates.append('title = ?')
             params.append(title)
         if content is not None:
+            if inline_images:
+                content = self.content_processor.attach_inline_images(
+                    cursor, entry_id, content, inline_images, media_path
+                )
+            # Images removed or replaced in this edit go to the outbox
+            self.media_handler.remove_unreferenced_inline(cursor, entry_id, content, media_path)
             updates.append('content = ?')
-            params.append(content)
+            params.append(self.content_processor.encode(content))
         if entry_date is not None:
             updates.append('entry_date = ?')
             params.append(entry_date)
@@ -187,8 +212,8 @@ class EntryManager:
         if not cursor.fetchone():
             return False
         
-        # Delete media files
-        self.media_handler.delete_media_files(entry_id, media_path)
+        # Media files are removed by the outbox worker once this commits
+        self.media_handler.queue_media_deletion(cursor, entry_id, media_path)
         
         # Delete from database
         cursor.execute('DELETE FROM media WHERE entry_id = ?', (entry_id,))
@@ -196,3 +221,59 @@ class EntryManager:
         cursor.execute('DELETE FROM entries WHERE id = ?', (entry_id,))
         
         return True
+
+    def prepare_backfill(self, cursor, media_path, after_id='', batch_size=50):
+        """Read a batch of existing entries and stage their data URI images.
+
+        No rows are written, so this holds no write lock. Returns (last_id,
+        prepared): the last entry id read, or None once every entry has been
+        read, and the batch to hand to apply_backfill.
+        """
+        cursor.execute('''
+            SELECT id, content FROM entries
+            WHERE id > ?
+            ORDER BY id
+            LIMIT ?
+        ''', (after_id, batch_size))
+        rows = cursor.fetchall()
+        if not rows:
+            return None, []
+        
+        prepared = []
+        try:
+            for entry_id, stored in rows:
+                content, inline_images = self.content_processor.stage_inline_images(
+                    self.content_processor.decode(stored), media_path
+                )
+                prepared.append((entry_id, stored, content, inline_images))
+        except Exception as e:
+            for _, _, _, inline_images in prepared:
+                self.media_handler.discard_staged(inline_images)
+            raise e
+        
+        return rows[-1][0], prepared
+
+    def apply_backfill(self, cursor, prepared, media_path):
+        """Rewrite a prepared batch in its current storage format.
+
+        Rows edited or deleted since prepare_backfill read them are skipped, so
+        a backfill never overwrites a newer edit; their staged images are never
+        recorded and are discarded by finalize_staged. Returns how many entries
+        were rewritten.
+        """
+        updated = 0
+        for entry_id, stored, content, inline_images in prepared:
+            cursor.execute('SELECT content FROM entries WHERE id = ?', (entry_id,))
+            current = cursor.fetchone()
+            if not current or current[0] != stored:
+                continue
+            
+            content = self.content_processor.attach_inline_images(
+                cursor, entry_id, content, inline_images, media_path
+            )
+            new_stored = self.content_processor.encode(content)
+            if new_stored != stored:
+                cursor.execute('UPDATE entries SET content = ? WHERE id = ?', (new_stored, entry_id))
+                updated += 1
+        
+        return updated
@@ -0,0 +1,311 @@
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from .media_handler import STAGING_DIR
+
+# Path part of any /media/... link in entry HTML, relative or absolute
+MEDIA_URL_PATTERN = re.compile(r'''/media/[^"'\s<>?#)]+''')
+
+class MaintenanceManager:
+    def __init__(self, media_handler, content_processor):
+        self.media_handler = media_handler
+        self.content_processor = content_processor
+        self.ORPHAN_GRACE_SECONDS = 24 * 60 * 60  # Leave files alone while an edit may still reference them
+        self.MAX_DELETIONS = 200  # Per run, so a large backlog is spread over several nights
+        self.BATCH_SIZE = 25  # Sweep actions per write queue operation
+        self.BATCH_PAUSE = 0.05  # Seconds to yield the writer to requests between batches
+        self.ANALYSIS_LIMIT = 400  # Rows sampled per index by ANALYZE
+        self.VACUUM_PAGES = 500  # Free pages returned to the filesystem per run
+
+    def run(self, conn, media_path, write_queue):
+        """Run every maintenance task and return a report of what was done.
+
+        conn is used for reads and the WAL checkpoint only; everything that
+        writes to the database goes through write_queue.
+        """
+        report = {
+            'started_at': datetime.utcnow().isoformat(),
+            'analyzed': False,
+            'optimized': False,
+            'orphan_files': 0,
+            'orphan_dirs': 0,
+            'dangling_rows': 0,
+            'recovered_files': 0,
+            'adopted_uploads': 0,
+            'bytes_reclaimed': 0,
+            'vacuum_pages': 0,
+            'checkpoint': None,
+        }
+        self.optimize(write_queue, report)
+        self.sweep_media(conn, media_path, write_queue, report)
+        self.incremental_vacuum(conn, write_queue, report)
+        self.checkpoint(conn, report)
+        report['finished_at'] = datetime.utcnow().isoformat()
+        return report
+
+    def optimize(self, write_queue, report):
+        """Refresh query planner statistics with a bounded ANALYZE"""
+        def analyze(cursor):
+            cursor.execute(f'PRAGMA analysis_limit = {self.ANALYSIS_LIMIT}')
+
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'")
+            analyzed = not cursor.fetchone()
+            if analyzed:
+                # PRAGMA optimize only re-analyzes tables that already have stats
+                cursor.execute('ANALYZE')
+
+            cursor.execute('PRAGMA optimize')
+            return analyzed
+
+        report['analyzed'] = write_queue.execute(analyze)
+        report['optimized'] = True
+
+    def incremental_vacuum(self, conn, write_queue, report):
+        """Return a bounded number of free pages to the filesystem"""
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != 2:
+            # Databases created before incremental auto_vacuum need a full VACUUM first,
+            # which is too heavy for a scheduled run
+            report['vacuum_pages'] = None
+            report['vacuum_skipped'] = ("auto_vacuum is not INCREMENTAL; "
+                                        "run 'flask --app app backfill-content' once to convert")
+            return
+
+        def vacuum(cursor):
+            cursor.execute('PRAGMA freelist_count')
+            before = cursor.fetchone()[0]
+            # sqlite3 steps a statement without result rows only once, and each step frees
+            # one page, so incremental_vacuum(N) would free a single page here
+            for _ in range(min(before, self.VACUUM_PAGES)):
+                cursor.execute('PRAGMA incremental_vacuum(1)')
+            cursor.execute('PRAGMA freelist_count')
+            return before - cursor.fetchone()[0]
+
+        report['vacuum_pages'] = write_queue.execute(vacuum)
+
+    def checkpoint(self, conn, report):
+        """Fold the WAL back into the database without blocking readers or writers"""
+        # Runs on conn rather than the writer: a checkpoint cannot make progress inside a transaction
+        cursor = conn.cursor()
+        cursor.execute('PRAGMA journal_mode')
+        if cursor.fetchone()[0] != 'wal':
+            return
+
+        cursor.execute('PRAGMA wal_checkpoint(PASSIVE)')
+        busy, log_pages, checkpointed = cursor.fetchone()
+        report['checkpoint'] = {'busy': busy, 'log_pages': log_pages, 'checkpointed': checkpointed}
+
+    def sweep_media(self, conn, media_path, write_queue, report):
+        """Reconcile the media table against the media directory.
+
+        conn is only read from. Row changes go through the write queue in small
+        batches and files are recorded in media_outbox, so nothing touches the
+        disk while the write lock is held and files only go once their rows have.
+        """
+        cursor = conn.cursor()
+        # Media rows are read before entries, so rows of an entry created mid-sweep are never orphans
+        cursor.execute('SELECT id, entry_id, filepath FROM media')
+        rows = cursor.fetchall()
+        cursor.execute('SELECT id FROM entries')
+        entry_ids = {row[0] for row in cursor.fetchall()}
+
+        # Decode every body once, before any write takes the lock
+        referenced = self._referenced_urls(cursor)
+        known_paths = {os.path.normpath(row[2]) for row in rows}
+
+        # (kind, key, path to remove); see _apply_sweep
+        actions = []
+
+        def budget_left():
+            return sum(1 for kind, _, _ in actions if kind != 'adopt') < self.MAX_DELETIONS
+
+        def remove(kind, key, path, counter):
+            actions.append((kind, key, path))
+            report[counter] += 1
+            report['bytes_reclaimed'] += self._path_size(path)
+
+        # Rows whose entry is gone, whose file is gone, or unattached uploads nobody uses
+        for media_id, entry_id, filepath in rows:
+            if not budget_left():
+                break
+            if entry_id is not None and entry_id not in entry_ids:
+                remove('row', media_id, filepath, 'orphan_files')
+            elif not os.path.exists(filepath):
+                staged_copy = os.path.join(media_path, STAGING_DIR, media_id)
+                if os.path.exists(staged_copy):
+                    # Committed but never moved out of staging; leave it to the writer during the grace period
+                    if self._is_stale(staged_copy) and self._recover_staged(staged_copy, filepath):
+                        report['recovered_files'] += 1
+                elif not os.path.exists(filepath):
+                    # Checked again, in case the writer finalized it since the first check
+                    actions.append(('row', media_id, None))
+                    report['dangling_rows'] += 1
+            elif entry_id is None and self._is_stale(filepath) \
+                    and not self._is_referenced(referenced, media_path, filepath):
+                remove('row', media_id, filepath, 'orphan_files')
+
+        names = sorted(os.listdir(media_path)) if os.path.isdir(media_path) else []
+        for name in names:
+            if not budget_left():
+                break
+            path = os.path.join(media_path, name)
+
+            if name == STAGING_DIR:
+                # A staged copy of a row that stays is a committed file still waiting to be moved
+                removed_ids = {key for kind, key, _ in actions if kind == 'row'}
+                live_ids = {row[0] for row in rows} - removed_ids
+                for filename in sorted(os.listdir(path)):
+                    filepath = os.path.join(path, filename)
+                    if filename in live_ids:
+                        continue
+                    if budget_left() and self._is_stale(filepath):
+                        # Staged by a write that never committed or finalized
+                        remove('file', None, filepath, 'orphan_files')
+                continue
+
+            if os.path.isdir(path):
+                if name not in entry_ids and self._is_stale(path):
+                    # Directory left behind by a delete that failed part way
+                    remove('entry_dir', name, path, 'orphan_dirs')
+                    continue
+                for filename in sorted(os.listdir(path)):
+                    filepath = os.path.join(path, filename)
+                    if os.path.normpath(filepath) in known_paths or not self._is_stale(filepath):
+                        continue
+                    if budget_left():
+                        # File from a save whose transaction rolled back
+                        remove('file', None, filepath, 'orphan_files')
+
+            elif os.path.normpath(path) not in known_paths and self._is_stale(path):
+                if self._is_referenced(referenced, media_path, path):
+                    # Editor upload from before uploads were recorded; track it from now on
+                    file_type = self.media_handler.get_file_type(name) or 'image'
+                    actions.append(('adopt', (name, file_type, self._path_size(path)), path))
+                    report['adopted_uploads'] += 1
+                else:
+                    remove('file', None, path, 'orphan_files')
+
+        for i in range(0, len(actions), self.BATCH_SIZE):
+            if i:
+                # Give the writer and the disk back to request handlers between batches
+                time.sleep(self.BATCH_PAUSE)
+            batch = actions[i:i + self.BATCH_SIZE]
+            write_queue.execute(lambda cursor, batch=batch: self._apply_sweep(cursor, batch))
+
+    def _apply_sweep(self, cursor, actions):
+        """Apply planned sweep actions on the writer; files are removed later by the outbox"""
+        for kind, key, path in actions:
+            if kind == 'adopt':
+                name, file_type, file_size = key
+                cursor.execute('''
+                    INSERT INTO media (id, entry_id, filename, filepath, file_type, file_size)
+                    VALUES (?, NULL, ?, ?, ?, ?)
+                ''', (str(uuid.uuid4()), name, path, file_type, file_size))
+                continue
+            if kind == 'row':
+                cursor.execute('DELETE FROM media WHERE id = ?', (key,))
+            elif kind == 'entry_dir':
+                cursor.execute('DELETE FROM media WHERE entry_id = ?', (key,))
+            if path:
+                self.media_handler.queue_path_deletion(cursor, path)
+
+    def _recover_staged(self, staged_copy, filepath):
+        """Move a committed file that finalize_staged could not move into place"""
+        try:
+            self.media_handler.move_into_place(staged_copy, filepath)
+            return True
+        except OSError as e:
+            print(f"Error recovering media file {filepath}: {str(e)}")
+            return False
+
+    def _is_stale(self, path):
+        """Check whether a path is older than the orphan grace period"""
+        try:
+            return time.time() - os.path.getmtime(path) > self.ORPHAN_GRACE_SECONDS
+        except OSError:
+            return False
+
+    def _referenced_urls(self, cursor):
+        """Collect every /media/ path linked from entry content, decoding each body once"""
+        referenced = set()
+        cursor.execute('SELECT content FROM entries')
+        for (stored,) in cursor:
+            content = self.content_processor.decode(stored)
+            if content:
+                referenced.update(MEDIA_URL_PATTERN.findall(content))
+        return referenced
+
+    @staticmethod
+    def _is_referenced(referenced, media_path, filepath):
+        """Check whether any entry's content links to this media file"""
+        url_path = '/media/' + os.path.relpath(filepath, media_path).replace(os.sep, '/')
+        return url_path in referenced
+
+    @staticmethod
+    def _path_size(path):
+        """Total size in bytes of a file or directory tree"""
+        if not os.path.isdir(path):
+            try:
+                return os.path.getsize(path)
+            except OSError:
+                return 0
+        size = 0
+        for root, _, files in os.walk(path):
+            for filename in files:
+                try:
+                    size += os.path.getsize(os.path.join(root, filename))
+                except OSError:
+                    continue
+        return size
+
+
+class MaintenanceScheduler:
+    """Runs database maintenance in a background thread during off-peak hours"""
+
+    def __init__(self, run_maintenance, interval_seconds=3600, quiet_hours=(2, 5)):
+        self.run_maintenance = run_maintenance
+        self.interval_seconds = interval_seconds
+        self.quiet_hours = quiet_hours
+        self.last_report = None
+        self._last_run_date = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the scheduler thread if it is not already running"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name='journal-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Ask the scheduler thread to exit"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join()
+
+    def in_quiet_hours(self, now=None):
+        """Check whether the local time falls in the off-peak window"""
+        hour = (now or datetime.now()).hour
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def _loop(self):
+        while not self._stop_event.wait(self.interval_seconds):
+            now = datetime.now()
+            # At most one run per night
+            if not self.in_quiet_hours(now) or self._last_run_date == now.date():
+                continue
+            self._last_run_date = now.date()
+            try:
+                self.last_report = self.run_maintenance()
+                print(f"Maintenance finished: {self.last_report}")
+            except Exception as e:
+                print(f"Error running maintenance: {str(e)}")
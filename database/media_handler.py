@@ -1,6 +1,11 @@
 import os
 import shutil
+import time
 import uuid
+from datetime import datetime
+
+# Files are written here first and moved into place once their rows have committed
+STAGING_DIR = '.staging'
 
 class MediaHandler:
     def __init__(self):
@@ -10,6 +15,8 @@ class MediaHandler:
             'audio': ['mp3', 'wav', 'm4a']
         }
         self.MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB in bytes
+        self.FINALIZE_ATTEMPTS = 2  # Tries to move a committed file out of staging
+        self.FINALIZE_RETRY_PAUSE = 0.05  # Seconds between those tries
 
     def allowed_file(self, filename):
         """Check if file type is allowed"""
@@ -42,42 +49,161 @@ class MediaHandler:
             
         return True, None
 
-    def save_media_files(self, cursor, entry_id, media_files, media_path):
-        """Save media files and create database records"""
-        if not media_files:
-            return
+    def stage_bytes(self, data, filename, file_type, media_path):
+        """Write data to the staging directory and return the staged file's record"""
+        staged = self._new_staged(filename, file_type, len(data), media_path)
+        with open(staged['temp_path'], 'wb') as f:
+            f.write(data)
+        return staged
+
+    def stage_media_files(self, media_files, media_path):
+        """Validate uploaded files and write them to staging, outside any transaction"""
+        staged_files = []
+        try:
+            for media_file in media_files or []:
+                if media_file.filename:
+                    # Validate file
+                    is_valid, error_message = self.validate_media_file(media_file)
+                    if not is_valid:
+                        raise ValueError(f"Invalid media file: {error_message}")
+                    
+                    # Get file size and type
+                    media_file.seek(0, os.SEEK_END)
+                    file_size = media_file.tell()
+                    media_file.seek(0)
+                    file_type = self.get_file_type(media_file.filename)
+                    
+                    staged = self._new_staged(media_file.filename, file_type, file_size, media_path)
+                    staged_files.append(staged)
+                    media_file.save(staged['temp_path'])
+        except Exception:
+            self.discard_staged(staged_files)
+            raise
+        return staged_files
+
+    def stage_upload(self, upload_file, filename, media_path):
+        """Write an editor upload to staging, outside any transaction"""
+        staged = self._new_staged(filename, self.get_file_type(filename) or 'image', 0, media_path)
+        try:
+            upload_file.save(staged['temp_path'])
+            staged['file_size'] = os.path.getsize(staged['temp_path'])
+        except Exception:
+            self.discard_staged([staged])
+            raise
+        return staged
+
+    def finalize_staged(self, staged_files):
+        """Move staged files into place; call after the transaction commits.
+
+        Every file is attempted even if one fails, since their rows are already committed.
+        A file that still cannot be moved stays in staging for maintenance to recover.
+        """
+        for staged in staged_files:
+            if not staged['filepath']:
+                # Staged but never recorded by the operation
+                self.discard_staged([staged])
+                continue
+            try:
+                self.move_into_place(staged['temp_path'], staged['filepath'])
+            except OSError as e:
+                print(f"Error finalizing media file {staged['filepath']}: {str(e)}; "
+                      f"maintenance will move it into place")
 
+    def move_into_place(self, temp_path, filepath):
+        """Move a staged file to its final path, retrying briefly before raising OSError"""
+        for attempt in range(self.FINALIZE_ATTEMPTS):
+            try:
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                os.replace(temp_path, filepath)
+                return
+            except OSError:
+                if attempt == self.FINALIZE_ATTEMPTS - 1:
+                    raise
+                time.sleep(self.FINALIZE_RETRY_PAUSE)
+
+    def discard_staged(self, staged_files):
+        """Remove staged files; call when the transaction rolls back"""
+        for staged in staged_files:
+            try:
+                os.remove(staged['temp_path'])
+            except OSError:
+                continue
+
+    def save_media_files(self, cursor, entry_id, staged_files, media_path):
+        """Create database records for staged media files"""
         entry_media_dir = os.path.join(media_path, entry_id)
-        os.makedirs(entry_media_dir, exist_ok=True)
-
-        for media_file in media_files:
-            if media_file.filename:
-                # Validate file
-                is_valid, error_message = self.validate_media_file(media_file)
-                if not is_valid:
-                    raise ValueError(f"Invalid media file: {error_message}")
-                
-                media_id = str(uuid.uuid4())
-                safe_filename = f"{media_id}_{media_file.filename}"
-                filepath = os.path.join(entry_media_dir, safe_filename)
-                
-                # Get file size and type
-                media_file.seek(0, os.SEEK_END)
-                file_size = media_file.tell()
-                media_file.seek(0)
-                file_type = self.get_file_type(media_file.filename)
-                
-                # Save file
-                media_file.save(filepath)
-                
-                # Save media record
-                cursor.execute('''
-                    INSERT INTO media (id, entry_id, filename, filepath, file_type, file_size)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', (media_id, entry_id, media_file.filename, filepath, file_type, file_size))
-
-    def delete_media_files(self, entry_id, media_path):
-        """Delete media files for an entry"""
-        media_dir = os.path.join(media_path, entry_id)
-        if os.path.exists(media_dir):
-            shutil.rmtree(media_dir)
+        for staged in staged_files:
+            self._record_staged(cursor, entry_id, staged, entry_media_dir)
+
+    def save_inline_image(self, cursor, entry_id, staged, media_path):
+        """Record a staged image extracted from entry content and return its /media/ URL"""
+        stored_name = self._record_staged(cursor, entry_id, staged, os.path.join(media_path, entry_id))
+        return f"/media/{entry_id}/{stored_name}"
+
+    def save_upload(self, cursor, staged, media_path):
+        """Record a staged editor upload that is not yet attached to an entry"""
+        # Recorded so maintenance can reconcile it against entry content
+        return self._record_staged(cursor, None, staged, media_path)
+
+    @staticmethod
+    def _new_staged(filename, file_type, file_size, media_path):
+        staging_dir = os.path.join(media_path, STAGING_DIR)
+        os.makedirs(staging_dir, exist_ok=True)
+        media_id = str(uuid.uuid4())
+        return {
+            'media_id': media_id,
+            'filename': filename,
+            'file_type': file_type,
+            'file_size': file_size,
+            'temp_path': os.path.join(staging_dir, media_id),
+            'filepath': None  # Set once the row is written
+        }
+
+    @staticmethod
+    def _record_staged(cursor, entry_id, staged, directory):
+        """Insert the media row for a staged file and return its stored filename"""
+        stored_name = f"{staged['media_id']}_{staged['filename']}"
+        staged['filepath'] = os.path.join(directory, stored_name)
+        cursor.execute('''
+            INSERT INTO media (id, entry_id, filename, filepath, file_type, file_size)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (staged['media_id'], entry_id, staged['filename'], staged['filepath'],
+              staged['file_type'], staged['file_size']))
+        return stored_name
+
+    def queue_media_deletion(self, cursor, entry_id, media_path):
+        """Record an entry's media directory in the outbox for removal after commit"""
+        self.queue_path_deletion(cursor, os.path.join(media_path, entry_id))
+
+    @staticmethod
+    def queue_path_deletion(cursor, path):
+        """Record a file or directory in the outbox for removal after commit"""
+        cursor.execute('''
+            INSERT INTO media_outbox (path, created_at)
+            VALUES (?, ?)
+        ''', (path, datetime.utcnow().isoformat()))
+
+    def remove_unreferenced_inline(self, cursor, entry_id, content, media_path):
+        """Drop an entry's extracted images that its content no longer links to"""
+        cursor.execute('''
+            SELECT id, filepath FROM media
+            WHERE entry_id = ? AND file_type = 'inline'
+        ''', (entry_id,))
+
+        removed = 0
+        for media_id, filepath in cursor.fetchall():
+            url_path = '/media/' + os.path.relpath(filepath, media_path).replace(os.sep, '/')
+            if url_path in content:
+                continue
+            cursor.execute('DELETE FROM media WHERE id = ?', (media_id,))
+            self.queue_path_deletion(cursor, filepath)
+            removed += 1
+        return removed
+
+    @staticmethod
+    def remove_path(path):
+        """Remove a file or directory tree; already missing counts as removed"""
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+class MediaOutbox:
+    """Background worker that removes media recorded in the media_outbox table.
+
+    Entry deletes only insert an outbox row, so the write transaction never
+    waits on the filesystem. The worker removes the paths afterwards and
+    deletes the rows through the write queue.
+    """
+
+    def __init__(self, connect, write_queue, media_handler, batch_size=20, poll_interval=300):
+        self.connect = connect
+        self.write_queue = write_queue
+        self.media_handler = media_handler
+        self.BATCH_SIZE = batch_size
+        self.BATCH_PAUSE = 0.05  # Seconds between batches so cleanup never hogs the disk
+        self.POLL_INTERVAL = poll_interval  # Seconds between sweeps when nobody calls notify()
+        self.MAX_ATTEMPTS = 5  # Give up on a path after this many failed removals
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """Wake the worker (starting it if needed) to process new outbox rows"""
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='journal-media-outbox', daemon=True)
+                    self._thread.start()
+        self._wakeup.set()
+
+    def drain(self):
+        """Process every pending outbox row and return how many paths were removed"""
+        removed = 0
+        after_id = 0
+        while True:
+            batch = self._pending(after_id)
+            if not batch:
+                return removed
+
+            done, failed = [], []
+            for outbox_id, path in batch:
+                try:
+                    self.media_handler.remove_path(path)
+                    done.append(outbox_id)
+                except OSError as e:
+                    print(f"Error removing media {path}: {str(e)}")
+                    failed.append(outbox_id)
+
+            self.write_queue.execute(lambda cursor: self._record(cursor, done, failed))
+            removed += len(done)
+            # Failures are retried on the next drain, not in this one
+            after_id = batch[-1][0]
+            if len(batch) < self.BATCH_SIZE:
+                return removed
+            time.sleep(self.BATCH_PAUSE)
+
+    def _pending(self, after_id):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, path FROM media_outbox
+                WHERE id > ? AND attempts < ?
+                ORDER BY id
+                LIMIT ?
+            ''', (after_id, self.MAX_ATTEMPTS, self.BATCH_SIZE))
+            return cursor.fetchall()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _record(cursor, done, failed):
+        cursor.executemany('DELETE FROM media_outbox WHERE id = ?', [(i,) for i in done])
+        cursor.executemany('UPDATE media_outbox SET attempts = attempts + 1 WHERE id = ?',
+                           [(i,) for i in failed])
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.POLL_INTERVAL)
+            self._wakeup.clear()
+            try:
+                self.drain()
+            except Exception as e:
+                print(f"Error draining media outbox: {str(e)}")
@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class WriteQueue:
+    """Funnels every write through one thread and commits queued writes together.
+
+    Each operation is a callable taking a cursor. It runs inside its own
+    savepoint, so a failing operation is rolled back on its own and its
+    exception is returned to its caller while the rest of the batch commits.
+
+    on_commit runs on the writer thread after the batch commits, before the
+    caller is woken; on_rollback runs if the operation's changes are discarded.
+    Both are for filesystem work that must follow the transaction's outcome.
+
+    Schema migration, WAL checkpoints and the full VACUUM in
+    Database.backfill_content intentionally run on their own connections:
+    they either happen before any writer exists or cannot run inside a
+    transaction. They wait on the lock through busy_timeout like any writer.
+    """
+
+    def __init__(self, connect, max_batch_size=64, max_batch_delay=0.002, result_timeout=60):
+        self.connect = connect
+        self.MAX_BATCH_SIZE = max_batch_size
+        self.MAX_BATCH_DELAY = max_batch_delay  # Seconds to wait for more writes before committing
+        self.RESULT_TIMEOUT = result_timeout  # Seconds execute() waits before giving up on the writer
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, operation, on_commit=None, on_rollback=None):
+        """Queue an operation and return a Future for its result"""
+        future = Future()
+        # Starting the writer and queueing happen under the lock, so a writer that
+        # is shutting down after a failure either fails this item or a new one picks it up
+        with self._lock:
+            self._ensure_started()
+            self._queue.put(((operation, on_commit, on_rollback), future))
+        return future
+
+    def execute(self, operation, on_commit=None, on_rollback=None):
+        """Queue an operation and wait for its result.
+
+        Raises concurrent.futures.TimeoutError if the writer does not answer
+        within RESULT_TIMEOUT; the operation may still run afterwards.
+        """
+        return self.submit(operation, on_commit, on_rollback).result(timeout=self.RESULT_TIMEOUT)
+
+    def close(self):
+        """Finish queued writes and stop the writer thread"""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(None)
+            self._thread = None
+        # Join outside the lock; a failing writer needs it to shut down
+        thread.join()
+
+    def _ensure_started(self):
+        """Start the writer thread if none is running; caller holds the lock"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='journal-writer', daemon=True)
+            self._thread.start()
+
+    def _open(self):
+        conn = self.connect()
+        try:
+            # Transactions are managed explicitly below
+            conn.isolation_level = None
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA busy_timeout = 5000')
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _run(self):
+        conn = None
+        batch = []
+        try:
+            conn = self._open()
+            while True:
+                batch, stopping = self._next_batch()
+                if batch:
+                    self._commit_batch(conn, batch)
+                batch = []
+                if stopping:
+                    return
+        except Exception as e:
+            print(f"Error in writer thread: {str(e)}")
+            self._fail_and_reset(batch, e)
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def _fail_and_reset(self, batch, error):
+        """Fail the current batch and everything queued, and let the next submit start a new writer"""
+        with self._lock:
+            self._thread = None
+            pending = list(batch)
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    pending.append(item)
+
+        for (_, _, on_rollback), future in pending:
+            if future.done():
+                continue
+            self._run_hook(on_rollback)
+            if future.running() or future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _next_batch(self):
+        """Block for one write, then gather more until the batch is full or the delay passes"""
+        item = self._queue.get()
+        if item is None:
+            return [], True
+
+        batch = [item]
+        deadline = time.monotonic() + self.MAX_BATCH_DELAY
+        while len(batch) < self.MAX_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _commit_batch(self, conn, batch):
+        """Run a batch in one transaction and resolve each operation's future"""
+        batch = [(operation, future) for operation, future in batch
+                 if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        cursor = conn.cursor()
+        outcomes = []
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            for (operation, _, on_rollback), _ in batch:
+                cursor.execute('SAVEPOINT write_op')
+                try:
+                    outcomes.append((True, operation(cursor)))
+                    cursor.execute('RELEASE write_op')
+                except Exception as e:
+                    cursor.execute('ROLLBACK TO write_op')
+                    cursor.execute('RELEASE write_op')
+                    self._run_hook(on_rollback)
+                    outcomes.append((False, e))
+            cursor.execute('COMMIT')
+        except Exception as e:
+            print(f"Error committing write batch: {str(e)}")
+            if conn.in_transaction:
+                conn.rollback()
+            for i, ((_, _, on_rollback), future) in enumerate(batch):
+                # Operations that failed on their own already ran their rollback hook
+                if i >= len(outcomes) or outcomes[i][0]:
+                    self._run_hook(on_rollback)
+                future.set_exception(e)
+            return
+
+        for ((_, on_commit, _), future), (ok, value) in zip(batch, outcomes):
+            if not ok:
+                future.set_exception(value)
+                continue
+            try:
+                if on_commit:
+                    on_commit()
+            except Exception as e:
+                # The rows are committed, so the caller still gets its result;
+                # failing here would make a retry create a duplicate
+                print(f"Error finalizing write: {str(e)}")
+            future.set_result(value)
+
+    @staticmethod
+    def _run_hook(hook):
+        if not hook:
+            return
+        try:
+            hook()
+        except Exception as e:
+            print(f"Error discarding rolled back write: {str(e)}")
@@ -0,0 +1,70 @@
+"""Startup timing breakdown for the journal app.
+
+Run it in a fresh interpreter so nothing is cached yet:
+
+    python startup_profile.py                  # print the breakdown
+    python startup_profile.py --budget-ms 500  # exit 1 if worker boot is over budget
+    python startup_profile.py --include-client # also time the first Anthropic client build
+
+Worker boot is everything up to the end of `import app`. The first database
+connection and the AI client are reported separately because they are paid
+lazily by the first request that needs them, not by the worker on boot.
+"""
+import argparse
+import sys
+import time
+
+
+def _timed(label, func, results):
+    """Run func and record how long it took in milliseconds"""
+    start = time.perf_counter()
+    value = func()
+    results.append((label, (time.perf_counter() - start) * 1000))
+    return value
+
+
+def profile_startup(include_client=False):
+    """Time each startup phase and return a list of (label, milliseconds)"""
+    results = []
+
+    _timed('import flask', lambda: __import__('flask'), results)
+    _timed('import database', lambda: __import__('database'), results)
+    app_module = _timed('import app', lambda: __import__('app'), results)
+
+    # First connection runs the one-time schema check
+    _timed('first db connection', lambda: app_module.db._connect().close(), results)
+
+    if include_client:
+        _timed('anthropic client', app_module.get_client, results)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report startup timing for the journal app')
+    parser.add_argument('--budget-ms', type=float, default=None,
+                        help='Fail if worker boot (imports up to app) exceeds this many milliseconds')
+    parser.add_argument('--include-client', action='store_true',
+                        help='Also time constructing the Anthropic client')
+    args = parser.parse_args()
+
+    if 'app' in sys.modules:
+        print("Warning: app is already imported, timings will be misleading")
+
+    results = profile_startup(args.include_client)
+    boot_phases = {'import flask', 'import database', 'import app'}
+    boot_ms = sum(ms for label, ms in results if label in boot_phases)
+
+    print("=== Startup Timing ===")
+    for label, ms in results:
+        print(f"{label:<24}{ms:>10.1f} ms")
+    print(f"{'worker boot total':<24}{boot_ms:>10.1f} ms")
+
+    if args.budget_ms is not None and boot_ms > args.budget_ms:
+        print(f"Worker boot exceeded budget of {args.budget_ms:.1f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from database import Database
+from database.content_processor import ContentProcessor, ZLIB_FORMAT
+from database.media_handler import MediaHandler
+from database.write_queue import WriteQueue
+
+
+def make_database(directory, **kwargs):
+    """Create a Database whose file and media live in directory"""
+    db = Database(**kwargs)
+    db.db_path = os.path.join(directory, 'journal.db')
+    db.media_path = os.path.join(directory, 'media')
+    return db
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db = make_database(self.directory)
+
+    def tearDown(self):
+        self.db.write_queue.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def outbox_paths(self):
+        conn = self.db._connect()
+        try:
+            return [row[0] for row in conn.execute('SELECT path FROM media_outbox ORDER BY id')]
+        finally:
+            conn.close()
+
+
+class WriteQueueTest(DatabaseTestCase):
+    def test_failing_operation_is_isolated_within_its_batch(self):
+        # A long batch delay makes the three writes share one transaction
+        write_queue = WriteQueue(self.db._connect, max_batch_delay=0.5)
+        hooks = []
+
+        def insert(path, fail=False):
+            def operation(cursor):
+                self.db.media_handler.queue_path_deletion(cursor, path)
+                if fail:
+                    raise ValueError('boom')
+                return path
+            return write_queue.submit(operation,
+                                      on_commit=lambda: hooks.append(('commit', path)),
+                                      on_rollback=lambda: hooks.append(('rollback', path)))
+
+        try:
+            futures = [insert('a'), insert('b', fail=True), insert('c')]
+            self.assertEqual(futures[0].result(timeout=5), 'a')
+            with self.assertRaises(ValueError):
+                futures[1].result(timeout=5)
+            self.assertEqual(futures[2].result(timeout=5), 'c')
+        finally:
+            write_queue.close()
+
+        self.assertEqual(self.outbox_paths(), ['a', 'c'])
+        self.assertEqual(sorted(hooks), [('commit', 'a'), ('commit', 'c'), ('rollback', 'b')])
+
+    def test_dead_writer_recovers(self):
+        attempts = []
+
+        def connect():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError('unable to open database file')
+            return self.db._connect()
+
+        write_queue = WriteQueue(connect)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                write_queue.execute(lambda cursor: 'lost')
+            self.assertEqual(write_queue.execute(lambda cursor: 'ok'), 'ok')
+        finally:
+            write_queue.close()
+        self.assertEqual(len(attempts), 2)
+
+    def test_concurrent_creates_do_not_hit_lock_errors(self):
+        def create(i):
+            return self.db.create_entry('user', f'Entry {i}', f'<p>Body {i}</p>', [f'tag{i % 5}'])
+
+        with ThreadPoolExecutor(max_workers=32) as executor:
+            entry_ids = list(executor.map(create, range(200)))
+
+        self.assertEqual(len(set(entry_ids)), 200)
+        self.assertEqual(len(self.db.get_entries('user')), 200)
+
+
+class MediaOutboxTest(DatabaseTestCase):
+    def queue(self, path):
+        self.db.write_queue.execute(lambda cursor: self.db.media_handler.queue_path_deletion(cursor, path))
+
+    def test_drain_removes_queued_paths(self):
+        entry_dir = os.path.join(self.directory, 'media', 'entry')
+        os.makedirs(entry_dir)
+        with open(os.path.join(entry_dir, 'a.png'), 'wb') as f:
+            f.write(b'a')
+        loose_file = os.path.join(self.directory, 'loose.png')
+        with open(loose_file, 'wb') as f:
+            f.write(b'b')
+
+        self.queue(entry_dir)
+        self.queue(loose_file)
+        self.queue(os.path.join(self.directory, 'already-gone.png'))
+
+        self.assertEqual(self.db.media_outbox.drain(), 3)
+        self.assertFalse(os.path.exists(entry_dir))
+        self.assertFalse(os.path.exists(loose_file))
+        self.assertEqual(self.outbox_paths(), [])
+
+    def test_failed_removal_is_retried_then_given_up(self):
+        self.queue(os.path.join(self.directory, 'stuck.png'))
+
+        with mock.patch.object(MediaHandler, 'remove_path', side_effect=OSError('busy')):
+            for _ in range(self.db.media_outbox.MAX_ATTEMPTS):
+                self.assertEqual(self.db.media_outbox.drain(), 0)
+        # Out of attempts: the row is kept for inspection but no longer retried
+        with mock.patch.object(MediaHandler, 'remove_path') as remove_path:
+            self.assertEqual(self.db.media_outbox.drain(), 0)
+        remove_path.assert_not_called()
+        self.assertEqual(len(self.outbox_paths()), 1)
+
+    def test_deleting_an_entry_queues_its_media(self):
+        entry_id = self.db.create_entry('user', 'Title', 'Body', [])
+        entry_dir = os.path.join(self.db.media_path, entry_id)
+        os.makedirs(entry_dir)
+
+        self.db.delete_entry('user', entry_id)
+        self.assertEqual(self.outbox_paths(), [entry_dir])
+        self.db.media_outbox.drain()
+        self.assertFalse(os.path.exists(entry_dir))
+
+
+class ContentProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.processor = ContentProcessor(MediaHandler(), compress=True, compress_threshold=64)
+
+    def test_large_content_round_trips_compressed(self):
+        content = '<p>' + 'journal ' * 100 + 'é</p>'
+        stored = self.processor.encode(content)
+        self.assertIsInstance(stored, bytes)
+        self.assertEqual(stored[:1], ZLIB_FORMAT)
+        self.assertEqual(self.processor.decode(stored), content)
+
+    def test_small_content_and_none_are_stored_as_is(self):
+        self.assertEqual(self.processor.encode('<p>short</p>'), '<p>short</p>')
+        self.assertIsNone(self.processor.encode(None))
+        self.assertIsNone(self.processor.decode(None))
+
+    def test_compression_disabled_leaves_content_as_text(self):
+        processor = ContentProcessor(MediaHandler())
+        content = 'x' * 10000
+        self.assertEqual(processor.encode(content), content)
+        # Bodies written with compression on are still readable after it is turned off
+        self.assertEqual(processor.decode(self.processor.encode(content)), content)
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.processor.decode(b'\x7fnot a known format')
+
+    def test_entries_round_trip_through_the_database(self):
+        directory = tempfile.mkdtemp()
+        db = make_database(directory, compress_content=True)
+        try:
+            content = '<p>' + 'a long day ' * 1000 + '</p>'
+            entry_id = db.create_entry('user', 'Title', content, [])
+            self.assertEqual(db.get_entry('user', entry_id)['content'], content)
+        finally:
+            db.write_queue.close()
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    unittest.main()